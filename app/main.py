@@ -1,12 +1,58 @@
+import argparse
+import asyncio
+import ctypes
+import itertools
+import heapq
+import os
+import resource
+import selectors
+import signal
 import socket
-import threading
 import time
+from collections import deque
 
-store = {}  # key -> (value, expiry_timestamp, list, or stream)
-expiry = {}  # key -> expiry timestamp
-blocking_clients = {}  # key -> [(conn, timeout_end_time)]
-blocking_clients_lock = threading.Lock()  # Lock for thread-safe access to blocking_clients
-client_transactions = {}  # conn -> list of queued commands
+try:
+    import uvloop
+except ImportError:  # Optional: fall back to the stdlib selector loop
+    uvloop = None
+
+# One dict per value type, so a lookup finds the value and its type at once without isinstance checks;
+# a key lives in at most one of them
+strings = {}  # key -> bytes value
+lists = {}  # key -> deque
+streams = {}  # key -> {'entries': {entry_id: {field: value}}}
+expiry = {}  # key -> expiry deadline in time.monotonic_ns(), strings only
+expiry_heap = []  # (deadline, key) min-heap; entries whose deadline no longer matches expiry[key] are stale
+# time.monotonic_ns() read once per batch of commands, as Redis caches its clock per event-loop
+# iteration: TTL checks and SET PX in one pipelined batch share a single clock read
+now_ns = 0
+key_waiters = {}  # key -> WaiterQueue of BlockedClient parked on the key, oldest first
+client_transactions = {}  # client -> list of queued commands
+
+# Canned replies, encoded once at import instead of on every request
+PONG = b"+PONG\r\n"
+OK = b"+OK\r\n"
+QUEUED = b"+QUEUED\r\n"
+NIL = b"$-1\r\n"
+NIL_ARRAY = b"*-1\r\n"
+ERR_UNKNOWN_COMMAND = b"-ERR unknown command\r\n"
+ERR_SERVER = b"-ERR server error\r\n"
+ERR_PROTOCOL = b"-ERR Protocol error\r\n"
+ERR_WRONG_ARGS = b"-ERR wrong number of arguments\r\n"
+ERR_SYNTAX = b"-ERR syntax error\r\n"
+ERR_NOT_INTEGER = b"-ERR value is not an integer or out of range\r\n"
+ERR_TIMEOUT_NOT_INTEGER = b"-ERR timeout is not an integer or out of range\r\n"
+ERR_WRONGTYPE = b"-ERR WRONGTYPE Operation against a key holding the wrong kind of value\r\n"
+ERR_NESTED_MULTI = b"-ERR MULTI calls can not be nested\r\n"
+ERR_EXEC_WITHOUT_MULTI = b"-ERR EXEC without MULTI\r\n"
+ERR_DISCARD_WITHOUT_MULTI = b"-ERR DISCARD without MULTI\r\n"
+ERR_XADD_ID_ZERO = b"-ERR The ID specified in XADD must be greater than 0-0\r\n"
+ERR_XADD_ID_TOO_SMALL = b"-ERR The ID specified in XADD is equal or smaller than the target stream top item\r\n"
+
+# Bulk-string length headers and integer replies for small values, likewise formatted once
+SMALL_INT_LIMIT = 1024
+BULK_HEADERS = [b"$%d\r\n" % n for n in range(SMALL_INT_LIMIT)]
+INTEGER_REPLIES = [b":%d\r\n" % n for n in range(SMALL_INT_LIMIT)]
 
 
 def generate_stream_id(stream_key, provided_id=None):
@@ -18,13 +64,11 @@ def generate_stream_id(stream_key, provided_id=None):
         return provided_id
     
     # Auto-generate full ID using current timestamp
-    if (stream_key not in store or 
-        not isinstance(store[stream_key], dict) or 
-        not store[stream_key].get('entries')):
+    if not streams.get(stream_key, {}).get('entries'):
         # First entry in stream - use current time with sequence 0
         return f"{current_time_ms}-0"
     
-    stream = store[stream_key]
+    stream = streams[stream_key]
     
     # Check if current timestamp already exists in stream
     max_seq_for_current_time = -1
@@ -55,13 +99,11 @@ def generate_sequence_number(stream_key, timestamp):
     """Generate sequence number for a given timestamp."""
     # Special case: if timestamp is 0, start with sequence 1
     if timestamp == 0:
-        if (stream_key not in store or 
-            not isinstance(store[stream_key], dict) or 
-            not store[stream_key].get('entries')):
+        if not streams.get(stream_key, {}).get('entries'):
             return 1
         
         # Find the highest sequence number for timestamp 0
-        stream = store[stream_key]
+        stream = streams[stream_key]
         max_seq = 0
         for entry_id in stream['entries']:
             entry_timestamp, entry_seq = map(int, entry_id.split('-'))
@@ -70,13 +112,11 @@ def generate_sequence_number(stream_key, timestamp):
         return max_seq + 1
     
     # For non-zero timestamps, start with sequence 0
-    if (stream_key not in store or 
-        not isinstance(store[stream_key], dict) or 
-        not store[stream_key].get('entries')):
+    if not streams.get(stream_key, {}).get('entries'):
         return 0
     
     # Find the highest sequence number for this timestamp
-    stream = store[stream_key]
+    stream = streams[stream_key]
     max_seq = -1  # Start with -1 so first entry gets sequence 0
     for entry_id in stream['entries']:
         entry_timestamp, entry_seq = map(int, entry_id.split('-'))
@@ -163,13 +203,11 @@ def validate_final_id(stream_key, entry_id):
         return False
     
     # If stream doesn't exist or is empty, any ID > 0-0 is valid
-    if (stream_key not in store or 
-        not isinstance(store[stream_key], dict) or 
-        not store[stream_key].get('entries')):
+    if not streams.get(stream_key, {}).get('entries'):
         return True
     
     # Get the last entry ID
-    stream = store[stream_key]
+    stream = streams[stream_key]
     last_id = list(stream['entries'].keys())[-1]
     last_timestamp, last_sequence = map(int, last_id.split('-'))
     
@@ -185,736 +223,1103 @@ def validate_final_id(stream_key, entry_id):
         return False
 
 
-def notify_blocking_clients(stream_key):
-    """Notify all blocking clients waiting on a specific stream."""
-    with blocking_clients_lock:
-        if stream_key in blocking_clients:
-            for client_info in blocking_clients[stream_key][:]:  # Copy list to avoid modification during iteration
-                conn, stream_keys, stream_ids, timeout_end = client_info
-                try:
-                    # Check if we have new entries for this client
-                    result = []
-                    for i, key in enumerate(stream_keys):
-                        if key == stream_key:
-                            start_id = stream_ids[i]
-                            
-                            # Check if stream exists and has new entries
-                            if (key in store and 
-                                isinstance(store[key], dict) and 
-                                store[key].get('entries')):
-                                
-                                stream = store[key]
-                                entries = stream['entries']
-                                
-                                # Find entries after the specified start_id
-                                stream_entries = []
-                                for entry_id in entries:
-                                    if compare_stream_ids(entry_id, start_id) > 0:
-                                        # Format entry data as [field1, value1, field2, value2, ...]
-                                        entry_data = entries[entry_id]
-                                        field_value_list = []
-                                        for field, value in entry_data.items():
-                                            field_value_list.extend([field, value])
-                                        stream_entries.append([entry_id, field_value_list])
-                                
-                                # Only include streams that have entries
-                                if stream_entries:
-                                    result.append([key, stream_entries])
-                    
-                    if result:
-                        # Send result to client and remove from blocking list
-                        conn.sendall(encode_resp(result))
-                        blocking_clients[stream_key].remove(client_info)
-                        if not blocking_clients[stream_key]:
-                            del blocking_clients[stream_key]
-                        
-                except Exception:
-                    # Remove client if there's an error (connection closed, etc.)
-                    if client_info in blocking_clients[stream_key]:
-                        blocking_clients[stream_key].remove(client_info)
-                    if not blocking_clients[stream_key]:
-                        del blocking_clients[stream_key]
-
-
-def cleanup_expired_blocking_clients():
-    """Remove expired blocking clients and send timeout responses."""
-    while True:
-        current_time = time.time()
-        with blocking_clients_lock:
-            for stream_key in list(blocking_clients.keys()):
-                for client_info in blocking_clients[stream_key][:]:  # Copy to avoid modification during iteration
-                    conn, stream_keys, stream_ids, timeout_end = client_info
-                    # Only timeout clients with finite timeout (not infinite)
-                    if timeout_end != float('inf') and current_time >= timeout_end:
-                        try:
-                            # Send null response for timeout
-                            conn.sendall(b"$-1\r\n")
-                        except Exception:
-                            pass  # Client connection might be closed
-                        
-                        # Remove client from blocking list
-                        blocking_clients[stream_key].remove(client_info)
-                        if not blocking_clients[stream_key]:
-                            del blocking_clients[stream_key]
-        
-        time.sleep(0.1)  # Check every 100ms
+# Active expiry: delete keys whose TTL has passed, so keys that are never read again do not stay in
+# memory forever. Cycles are timed off the heap top rather than ticking, so with no TTLs due the
+# server never wakes for it
+ACTIVE_EXPIRE_INTERVAL = 0.1  # Minimum seconds between cycles
+ACTIVE_EXPIRE_BUDGET_NS = 25_000_000  # Stop a cycle after 25ms (a quarter of the interval)
+ACTIVE_EXPIRE_BATCH = 64  # Heap pops between clock reads
+active_expire_timer = None  # TimerHandle of the next cycle, None when none is scheduled
+
+
+def schedule_active_expire(delay):
+    """Run an active expiry cycle in delay seconds (at least the interval), unless one is due sooner."""
+    global active_expire_timer
+    loop = asyncio.get_running_loop()
+    delay = max(delay, ACTIVE_EXPIRE_INTERVAL)
+    if active_expire_timer is not None:
+        if active_expire_timer.when() <= loop.time() + delay:
+            return
+        active_expire_timer.cancel()
+    active_expire_timer = loop.call_later(delay, active_expire_cycle)
+
+
+def active_expire_cycle():
+    """Pop expired deadlines off the expiry heap and delete their keys, then schedule the next cycle."""
+    global active_expire_timer
+    active_expire_timer = None
+    heap = expiry_heap
+    now = time.monotonic_ns()
+    stop = now + ACTIVE_EXPIRE_BUDGET_NS
+    # The heap top says whether anything is due; nothing is scanned when it is not
+    while heap and heap[0][0] < now:
+        for _ in range(ACTIVE_EXPIRE_BATCH):
+            if not heap or heap[0][0] >= now:
+                break
+            deadline, key = heapq.heappop(heap)
+            # Skip entries left behind when the key was SET again with another TTL or none
+            if expiry.get(key) == deadline:
+                del strings[key]
+                del expiry[key]
+        now = time.monotonic_ns()
+        if now > stop:
+            break
+    if heap:
+        schedule_active_expire((heap[0][0] - now) / 1e9)
+
+
+class WaiterQueue(deque):
+    """FIFO of the BlockedClients parked on one key.
+
+    Cancelled waiters are only marked inactive and dropped once they reach the head, so a timeout
+    or disconnect never scans the queue; the queue is compacted when dead entries outnumber live ones.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.dead = 0
+
+    def prune(self):
+        """Drop inactive waiters from the head, compacting the queue once it is mostly dead."""
+        while self and not self[0].active:
+            self.popleft()
+            self.dead -= 1
+        if self.dead > len(self) >> 1:
+            live = [waiter for waiter in self if waiter.active]
+            self.clear()
+            self.extend(live)
+            self.dead = 0
+
 
+class BlockedClient:
+    """A client parked in BLPOP/XREAD BLOCK until one of its keys receives data or it times out."""
 
-def parse_resp(buffer):
-    """Parse RESP messages."""
-    if not buffer:
-        return None, buffer
+    def __init__(self, client, keys, attempt, timeout_reply, timeout):
+        self.client = client
+        self.keys = keys
+        self.attempt = attempt  # callable returning the reply bytes, or None if still nothing to serve
+        self.timeout_reply = timeout_reply
+        self.active = True
+        self.timer = None
+        if timeout != float('inf'):
+            self.timer = asyncio.get_running_loop().call_later(timeout, self.finish, timeout_reply)
+        for key in keys:
+            waiters = key_waiters.get(key)
+            if waiters is None:
+                waiters = key_waiters[key] = WaiterQueue()
+            waiters.append(self)
 
-    if buffer.startswith(b"*"):
-        lines = buffer.split(b"\r\n")
-        if len(lines) < 1:
-            return None, buffer
+    def cancel(self):
+        """Unregister from all keys and drop the pending timeout."""
+        if not self.active:
+            return
+        self.active = False
+        if self.timer:
+            self.timer.cancel()
+        for key in self.keys:
+            waiters = key_waiters.get(key)
+            if waiters is not None:
+                waiters.dead += 1
+                waiters.prune()
+                if not waiters:
+                    del key_waiters[key]
+
+    def finish(self, reply):
+        """Send the reply and let the client carry on with its pipelined commands."""
+        self.cancel()
+        self.client.unblock(reply)
+
+
+def notify_key(key):
+    """Serve clients blocked on a key that just received new data, oldest first."""
+    waiters = key_waiters.get(key)
+    if not waiters:
+        return
+    lst = lists.get(key)
+    if lst is not None:
+        # A BLPOP waiter is always served while the list has elements, so wake the oldest one per
+        # element without copying or scanning the rest of the queue (finish() drops it from the head)
+        while lst and waiters:
+            waiter = waiters[0]
+            reply = waiter.attempt()
+            if reply is None:
+                # XREAD BLOCK parked on the key name before it became a list; it stays parked and
+                # the waiters behind it are served by the scan below
+                break
+            waiter.finish(reply)
+        else:
+            return
+    for waiter in list(waiters):  # Copy to avoid modification during iteration
+        if not waiter.active:
+            continue
+        reply = waiter.attempt()
+        if reply is not None:
+            waiter.finish(reply)
+
+
+def collect_stream_entries(stream_keys, start_ids):
+    """Collect entries newer than start_ids for each stream, in XREAD reply format."""
+    result = []
+    for stream_key, start_id in zip(stream_keys, start_ids):
+        # Check if stream exists
+        if not streams.get(stream_key, {}).get('entries'):
+            continue
         
-        try:
-            n = int(lines[0][1:])
-        except (ValueError, IndexError):
-            return None, buffer
-            
-        parts = []
-        idx = 1
-        for _ in range(n):
-            if idx >= len(lines) or not lines[idx].startswith(b"$"):
-                return None, buffer
-            try:
-                length = int(lines[idx][1:])
-                if idx + 1 >= len(lines):
-                    return None, buffer
-                parts.append(lines[idx + 1].decode())
-                idx += 2
-            except (ValueError, IndexError):
-                return None, buffer
-        return parts, b"\r\n".join(lines[idx:])
-    else:
-        try:
-            parts = buffer.decode().strip().split()
-            return parts, b""
-        except UnicodeDecodeError:
-            return None, buffer
+        entries = streams[stream_key]['entries']
+        
+        # Find entries after the specified start_id
+        stream_entries = []
+        for entry_id in entries:
+            if compare_stream_ids(entry_id, start_id) > 0:
+                # Format entry data as [field1, value1, field2, value2, ...]
+                entry_data = entries[entry_id]
+                field_value_list = []
+                for field, value in entry_data.items():
+                    field_value_list.extend([field, value])
+                stream_entries.append([entry_id, field_value_list])
+        
+        # Only include streams that have entries
+        if stream_entries:
+            result.append([stream_key, stream_entries])
+    return result
+
+
+# RESPParser states
+READ_ARRAY_HEADER = 0
+READ_BULK_HEADER = 1
+READ_BULK_BODY = 2
+
+
+# Receive buffers of closed connections, handed to the next accepted one instead of allocating
+PARSER_BUFFER_POOL_SIZE = 64
+parser_buffers = []
+
+
+def parse_length(buf, start, end):
+    """Parse the decimal length in buf[start:end] of a RESP header, skipping int() for one or two digits."""
+    width = end - start
+    if width == 1:
+        digit = buf[start] - 48  # ASCII '0'
+        if 0 <= digit <= 9:
+            return digit
+    elif width == 2:
+        tens = buf[start] - 48
+        digit = buf[start + 1] - 48
+        if 0 <= tens <= 9 and 0 <= digit <= 9:
+            return tens * 10 + digit
+    return int(buf[start:end])
+
+
+class RESPParser:
+    """Incremental RESP parser that resumes from where the last read stopped instead of rescanning."""
+
+    def __init__(self, capacity=65536):
+        # Persistent receive buffer that the socket reads straight into; only buf[:end] is valid data
+        self.capacity = capacity
+        if parser_buffers and len(parser_buffers[-1]) == capacity:
+            self.buf = parser_buffers.pop()
+        else:
+            self.buf = bytearray(capacity)
+        self.end = 0
+        self.pos = 0  # Bytes before this offset have already been parsed
+        self.state = READ_ARRAY_HEADER
+        self.array_len = 0
+        self.pending_array = []  # Bulk strings parsed so far for the current command
+        self.pending_bulk_len = 0
+
+    def release(self):
+        """Return the receive buffer to the pool; the parser sees no further input afterwards."""
+        if len(self.buf) == self.capacity and len(parser_buffers) < PARSER_BUFFER_POOL_SIZE:
+            parser_buffers.append(self.buf)
+        self.buf = bytearray()
+        self.end = self.pos = 0
+        self.state = READ_ARRAY_HEADER
+        self.pending_array = []
+
+    def get_buffer(self):
+        """Return a writable view of the free space after the received bytes, for recv_into."""
+        if self.pos:
+            remaining = self.end - self.pos
+            if remaining == 0 and len(self.buf) > self.capacity:
+                # Drop a buffer that grew for one oversized command once it is fully parsed
+                self.buf = bytearray(self.capacity)
+            elif remaining:
+                # Move the unparsed tail to the front so the free space is contiguous
+                self.buf[:remaining] = self.buf[self.pos:self.end]
+            self.end = remaining
+            self.pos = 0
+        if self.end == len(self.buf):
+            # A single command larger than the buffer: double it
+            self.buf.extend(bytes(len(self.buf)))
+        return memoryview(self.buf)[self.end:]
+
+    def buffer_updated(self, nbytes):
+        """Account for nbytes written by recv_into into the view from get_buffer()."""
+        self.end += nbytes
+
+    def next_command(self):
+        """Return the next complete command as a list of bytes, or None if more data is needed."""
+        # Work on locals and store the state back once on exit; attribute access per byte-level
+        # step is the dominant interpreter cost in this loop
+        buf = self.buf
+        find = buf.find
+        data_end = self.end
+        pos = self.pos
+        state = self.state
+        array_len = self.array_len
+        parts = self.pending_array
+        bulk_len = self.pending_bulk_len
+        result = None
+        while True:
+            if state == READ_ARRAY_HEADER:
+                if pos < data_end and buf[pos] != 42:  # '*'
+                    # Inline command such as "PING\r\n", or "PING\n" as sent by echo | nc
+                    newline = find(b"\n", pos, data_end)
+                    if newline == -1:
+                        break
+                    inline_parts = bytes(buf[pos:newline]).split()  # split() also drops the CR
+                    pos = newline + 1
+                    if inline_parts:
+                        result = inline_parts
+                        break
+                    continue
+                crlf = find(b"\r\n", pos, data_end)
+                if crlf == -1:
+                    break
+                array_len = parse_length(buf, pos + 1, crlf)
+                pos = crlf + 2
+                if array_len > 0:
+                    state = READ_BULK_HEADER
+
+            elif state == READ_BULK_HEADER:
+                crlf = find(b"\r\n", pos, data_end)
+                if crlf == -1:
+                    break
+                if buf[pos] != 36:  # '$'
+                    raise ValueError("Protocol error: expected '$'")
+                bulk_len = parse_length(buf, pos + 1, crlf)
+                pos = crlf + 2
+                state = READ_BULK_BODY
+
+            else:
+                # READ_BULK_BODY: wait until the payload and its trailing CRLF are buffered
+                end = pos + bulk_len
+                if data_end < end + 2:
+                    break
+                # Copy just the payload out as bytes; values are binary-safe and never decoded.
+                # Large payloads go through a memoryview to avoid an intermediate bytearray copy.
+                if bulk_len < 4096:
+                    parts.append(bytes(buf[pos:end]))
+                else:
+                    parts.append(bytes(memoryview(buf)[pos:end]))
+                pos = end + 2
+                if len(parts) < array_len:
+                    state = READ_BULK_HEADER
+                    continue
+                result = parts
+                parts = []
+                state = READ_ARRAY_HEADER
+                break
+
+        self.pos = pos
+        self.state = state
+        self.array_len = array_len
+        self.pending_array = parts
+        self.pending_bulk_len = bulk_len
+        return result
 
 
 def encode_resp(data):
     """Encode Python object to RESP format."""
     if data is None:
-        return b"$-1\r\n"
+        return NIL
     if isinstance(data, str):
-        return f"${len(data)}\r\n{data}\r\n".encode()
+        data = data.encode()
+    if isinstance(data, bytes):
+        return b"".join((bulk_header(len(data)), data, b"\r\n"))
     if isinstance(data, int):
-        return f":{data}\r\n".encode()
+        if 0 <= data < SMALL_INT_LIMIT:
+            return INTEGER_REPLIES[data]
+        return b":%d\r\n" % data
     if isinstance(data, list):
-        out = f"*{len(data)}\r\n"
+        out = [b"*%d\r\n" % len(data)]
         for item in data:
-            if item is None:
-                out += "$-1\r\n"
-            elif isinstance(item, str):
-                out += f"${len(item)}\r\n{item}\r\n"
-            elif isinstance(item, int):
-                out += f":{item}\r\n"
-            elif isinstance(item, list):
-                # Recursively encode nested arrays
-                nested = encode_resp(item).decode()
-                out += nested
+            if item is None or isinstance(item, (str, bytes, int, list)):
+                # Recursively encode nested values
+                out.append(encode_resp(item))
             else:
                 # Convert to string if unknown type
-                item_str = str(item)
-                out += f"${len(item_str)}\r\n{item_str}\r\n"
-        return out.encode()
-    return b"+OK\r\n"
+                out.append(encode_resp(str(item)))
+        return b"".join(out)
+    return OK
 
 
-def execute_single_command(command_parts):
-    """Execute a single command and return the response as a Python object."""
-    if not command_parts:
-        return None
+def bulk_header(length):
+    """Return the $<length> header of a bulk string, from the cache when the length is small."""
+    if length < SMALL_INT_LIMIT:
+        return BULK_HEADERS[length]
+    return b"$%d\r\n" % length
 
-    cmd = command_parts[0].upper()
-
-    # SET
-    if cmd == "SET":
-        if len(command_parts) < 3:
-            raise ValueError("ERR wrong number of arguments for 'set' command")
-        key, value = command_parts[1], command_parts[2]
-        store[key] = value
-        if len(command_parts) > 3 and command_parts[3].upper() == "PX":
-            if len(command_parts) < 5:
-                raise ValueError("ERR syntax error")
-            try:
-                expiry_ms = int(command_parts[4])
-                expiry[key] = time.time() + expiry_ms / 1000.0
-            except ValueError:
-                raise ValueError("ERR value is not an integer or out of range")
-        return "OK"
-
-    # GET
-    elif cmd == "GET":
-        if len(command_parts) < 2:
-            raise ValueError("ERR wrong number of arguments for 'get' command")
-        key = command_parts[1]
-        if key in expiry and time.time() > expiry[key]:
-            del store[key]
+
+def encode_bulk_fragments(value):
+    """Encode a bulk string as [header, payload, CRLF] so the payload is handed to the kernel uncopied."""
+    return [bulk_header(len(value)), value, b"\r\n"]
+
+
+def encode_bulk_array_fragments(items):
+    """Encode a flat array of bulk strings as a fragment list for a single scatter write."""
+    fragments = [b"*%d\r\n" % len(items)]
+    for item in items:
+        fragments.append(bulk_header(len(item)))
+        fragments.append(item)
+        fragments.append(b"\r\n")
+    return fragments
+
+
+def cmd_ping(client, command_parts):
+    return PONG
+
+
+def cmd_echo(client, command_parts):
+    if len(command_parts) < 2:
+        return ERR_WRONG_ARGS
+    return encode_resp(command_parts[1])
+
+
+def cmd_multi(client, command_parts):
+    # Check if client is already in transaction
+    if client in client_transactions:
+        return ERR_NESTED_MULTI
+    # Start a new transaction for this client
+    client_transactions[client] = []
+    return OK
+
+
+def cmd_exec(client, command_parts):
+    # Check if client is in transaction mode
+    if client not in client_transactions:
+        return ERR_EXEC_WITHOUT_MULTI
+    
+    # End the transaction by removing client from transaction state
+    queued_commands = client_transactions.pop(client)
+    
+    # Execute all queued commands and collect their encoded replies
+    replies = []
+    for command in queued_commands:
+        try:
+            # Queued commands run without a client, so blocking commands cannot park
+            reply = COMMANDS[command[0].upper()](None, command)
+            replies.append(reply if type(reply) is bytes else b"".join(reply))
+        except Exception:
+            # Handle unexpected errors
+            replies.append(ERR_SERVER)
+    
+    return b"*%d\r\n" % len(replies) + b"".join(replies)
+
+
+def cmd_discard(client, command_parts):
+    # Check if client is in transaction mode
+    if client not in client_transactions:
+        return ERR_DISCARD_WITHOUT_MULTI
+    # Discard the transaction by removing client from transaction state
+    del client_transactions[client]
+    return OK
+
+
+def cmd_set(client, command_parts):
+    if len(command_parts) < 3:
+        return ERR_WRONG_ARGS
+    key, value = command_parts[1], command_parts[2]
+    if len(command_parts) > 3 and command_parts[3].upper() == b"PX":
+        if len(command_parts) < 5:
+            return ERR_SYNTAX
+        try:
+            expiry_ms = int(command_parts[4])
+        except ValueError:
+            return ERR_NOT_INTEGER
+        # Monotonic clock: deadlines are unaffected by wall-clock (NTP) adjustments
+        deadline = now_ns + expiry_ms * 1_000_000
+        expiry[key] = deadline
+        heapq.heappush(expiry_heap, (deadline, key))
+        schedule_active_expire(expiry_ms / 1000.0)
+    elif expiry:
+        # A plain SET clears any TTL left over from an earlier SET ... PX
+        expiry.pop(key, None)
+    # SET replaces a value of any type
+    if key in lists:
+        del lists[key]
+    elif key in streams:
+        del streams[key]
+    strings[key] = value
+    return OK
+
+
+def cmd_get(client, command_parts):
+    if len(command_parts) < 2:
+        return ERR_WRONG_ARGS
+    key = command_parts[1]
+    value = strings.get(key)
+    if value is None:
+        return NIL
+    # Skip the TTL lookup entirely while no key carries one
+    if expiry:
+        deadline = expiry.get(key)
+        if deadline is not None and now_ns > deadline:
+            del strings[key]
             del expiry[key]
-            return None
-        elif key in store and isinstance(store[key], str):
-            return store[key]
-        else:
-            return None
+            return NIL
+    return encode_bulk_fragments(value)
 
-    # INCR
-    elif cmd == "INCR":
-        if len(command_parts) < 2:
-            raise ValueError("ERR wrong number of arguments for 'incr' command")
-        key = command_parts[1]
-        
-        # Check if key exists and is expired
-        if key in expiry and time.time() > expiry[key]:
-            del store[key]
+
+def cmd_incr(client, command_parts):
+    if len(command_parts) < 2:
+        return ERR_WRONG_ARGS
+    key = command_parts[1]
+    
+    # Check if key exists and is expired
+    if expiry:
+        deadline = expiry.get(key)
+        if deadline is not None and now_ns > deadline:
+            del strings[key]
             del expiry[key]
+    
+    if key in strings:
+        try:
+            # Try to convert the value to an integer
+            current_value = int(strings[key])
+        except ValueError:
+            # Value is not a valid integer
+            return ERR_NOT_INTEGER
+        # Increment by 1
+        new_value = current_value + 1
+    elif key in lists or key in streams:
+        # Key exists but is not a string
+        return ERR_WRONGTYPE
+    else:
+        # Key doesn't exist - treat as if value was 0, then increment to 1
+        new_value = 1
+    # Store the new value as a string and return it as an integer
+    strings[key] = b"%d" % new_value
+    return encode_resp(new_value)
+
+
+def cmd_rpush(client, command_parts):
+    key = command_parts[1]
+    values = command_parts[2:]
+    lst = lists.get(key)
+    if lst is None:
+        if key in strings or key in streams:
+            return ERR_WRONGTYPE
+        lst = lists[key] = deque()
+    lst.extend(values)
+    reply = encode_resp(len(lst))
+    # Wake clients blocked in BLPOP on this key
+    notify_key(key)
+    return reply
+
+
+def cmd_lpush(client, command_parts):
+    key = command_parts[1]
+    values = command_parts[2:]
+    lst = lists.get(key)
+    if lst is None:
+        if key in strings or key in streams:
+            return ERR_WRONGTYPE
+        lst = lists[key] = deque()
+    # Insert values one by one at the beginning (extendleft reverses them, as Redis does)
+    lst.extendleft(values)
+    reply = encode_resp(len(lst))
+    # Wake clients blocked in BLPOP on this key
+    notify_key(key)
+    return reply
+
+
+def cmd_lpop(client, command_parts):
+    key = command_parts[1]
+    lst = lists.get(key)
+    if not lst:
+        return NIL
+    if len(command_parts) == 2:
+        # Plain LPOP: reply with the element directly, no count parsing or intermediate list
+        return encode_bulk_fragments(lst.popleft())
+    count = int(command_parts[2])
+    popped = [lst.popleft() for _ in range(min(count, len(lst)))]
+    if count == 1:
+        return encode_bulk_fragments(popped[0])
+    else:
+        return encode_bulk_array_fragments(popped)
+
+
+def cmd_blpop(client, command_parts):
+    keys = command_parts[1:-1]
+    timeout = float(command_parts[-1])
+
+    # Special case: timeout 0 means block indefinitely
+    if timeout == 0:
+        timeout = float('inf')
         
-        if key in store:
-            # Key exists - check if it's a string type
-            if isinstance(store[key], str):
-                try:
-                    # Try to convert the value to an integer
-                    current_value = int(store[key])
-                    # Increment by 1
-                    new_value = current_value + 1
-                    # Store the new value as a string
-                    store[key] = str(new_value)
-                    # Return the new value as an integer
-                    return new_value
-                except ValueError:
-                    # Value is not a valid integer
-                    raise ValueError("ERR value is not an integer or out of range")
-            else:
-                # Key exists but is not a string (could be list, stream, etc.)
-                raise ValueError("ERR WRONGTYPE Operation against a key holding the wrong kind of value")
-        else:
-            # Key doesn't exist - treat as if value was 0, then increment to 1
-            new_value = 1
-            store[key] = str(new_value)
-            return new_value
+    def pop_first():
+        for k in keys:
+            lst = lists.get(k)
+            if lst:
+                value = lst.popleft()
+                # Return array with key and value
+                return encode_bulk_array_fragments([k, value])
+        return None
+
+    reply = pop_first()
+    if reply is not None or client is None:
+        # Inside EXEC there is no client to park, so behave as if the timeout expired
+        return reply or NIL_ARRAY
+    # Park the client until a push to one of the keys, or return null array on timeout
+    client.block(BlockedClient(client, keys, pop_first, NIL_ARRAY, timeout))
+    return None
+
 
-    # Add other commands as needed
+def cmd_lrange(client, command_parts):
+    key = command_parts[1]
+    start = int(command_parts[2])
+    stop = int(command_parts[3])
+    
+    lst = lists.get(key)
+    if lst is None:
+        # Return empty array if key doesn't exist or isn't a list
+        return encode_resp([])
+    
+    # Handle negative indices
+    if start < 0:
+        start = len(lst) + start
+    if stop < 0:
+        stop = len(lst) + stop
+    
+    # Clamp indices to valid range
+    start = max(0, start)
+    stop = min(len(lst) - 1, stop)
+    
+    if start <= stop and start < len(lst):
+        # deque has no slicing; islice walks to start and copies only the range
+        result = list(itertools.islice(lst, start, stop + 1))
+        return encode_bulk_array_fragments(result)
     else:
-        raise ValueError(f"ERR unknown command '{cmd.lower()}'")
+        return encode_resp([])
 
 
-def handle_command(conn, command_parts):
-    if not command_parts:
-        return
+def cmd_llen(client, command_parts):
+    key = command_parts[1]
+    lst = lists.get(key)
+    if lst is None:
+        # Return 0 if key doesn't exist or isn't a list
+        return encode_resp(0)
+    # Return the length of the list
+    return encode_resp(len(lst))
 
-    cmd = command_parts[0].upper()
 
-    # PING
-    if cmd == "PING":
-        conn.sendall(b"+PONG\r\n")
+def cmd_type(client, command_parts):
+    key = command_parts[1]
+    if key in strings:
+        return encode_resp("string")
+    elif key in lists:
+        return encode_resp("list")
+    elif key in streams:
+        return encode_resp("stream")
+    else:
+        # Key doesn't exist
+        return encode_resp("none")
 
-    # ECHO
-    elif cmd == "ECHO" and len(command_parts) > 1:
-        conn.sendall(encode_resp(command_parts[1]))
 
-    # MULTI
-    elif cmd == "MULTI":
-        # Check if client is already in transaction
-        if conn in client_transactions:
-            conn.sendall(b"-ERR MULTI calls can not be nested\r\n")
-        else:
-            # Start a new transaction for this client
-            client_transactions[conn] = []
-            conn.sendall(b"+OK\r\n")
-
-    # EXEC
-    elif cmd == "EXEC":
-        # Check if client is in transaction mode
-        if conn not in client_transactions:
-            conn.sendall(b"-ERR EXEC without MULTI\r\n")
-        else:
-            # Get the queued commands for this client
-            queued_commands = client_transactions[conn]
-            
-            # Execute all queued commands and collect responses
-            responses = []
-            for command in queued_commands:
-                try:
-                    # Execute the command and get the response
-                    response = execute_single_command(command)
-                    responses.append(response)
-                except ValueError as e:
-                    # Handle errors by adding error string to responses
-                    error_msg = str(e)
-                    if error_msg.startswith("ERR "):
-                        responses.append(error_msg)
-                    else:
-                        responses.append("ERR " + error_msg)
-                except Exception:
-                    # Handle unexpected errors
-                    responses.append("ERR server error")
-            
-            # Send the array of responses
-            conn.sendall(encode_resp(responses))
-            
-            # End the transaction by removing client from transaction state
-            del client_transactions[conn]
-
-    # DISCARD
-    elif cmd == "DISCARD":
-        # Check if client is in transaction mode
-        if conn not in client_transactions:
-            conn.sendall(b"-ERR DISCARD without MULTI\r\n")
-        else:
-            # Discard the transaction by removing client from transaction state
-            del client_transactions[conn]
-            # Return OK to indicate successful discard
-            conn.sendall(b"+OK\r\n")
-
-    # SET
-    elif cmd == "SET":
-        if conn in client_transactions:
-            # Queue the command in transaction mode
-            client_transactions[conn].append(command_parts)
-            conn.sendall(b"+QUEUED\r\n")
-        else:
-            # Execute immediately in normal mode
-            key, value = command_parts[1], command_parts[2]
-            store[key] = value
-            if len(command_parts) > 3 and command_parts[3].upper() == "PX":
-                expiry[key] = time.time() + int(command_parts[4]) / 1000.0
-            conn.sendall(b"+OK\r\n")
-
-    # GET
-    elif cmd == "GET":
-        if conn in client_transactions:
-            # Queue the command in transaction mode
-            client_transactions[conn].append(command_parts)
-            conn.sendall(b"+QUEUED\r\n")
-        else:
-            # Execute immediately in normal mode
-            key = command_parts[1]
-            if key in expiry and time.time() > expiry[key]:
-                del store[key]
-                del expiry[key]
-                conn.sendall(b"$-1\r\n")
-            elif key in store and isinstance(store[key], str):
-                conn.sendall(encode_resp(store[key]))
-            else:
-                conn.sendall(b"$-1\r\n")
-
-    # INCR
-    elif cmd == "INCR":
-        if conn in client_transactions:
-            # Queue the command in transaction mode
-            client_transactions[conn].append(command_parts)
-            conn.sendall(b"+QUEUED\r\n")
-        else:
-            # Execute immediately in normal mode
-            key = command_parts[1]
-            
-            # Check if key exists and is expired
-            if key in expiry and time.time() > expiry[key]:
-                del store[key]
-                del expiry[key]
-            
-            if key in store:
-                # Key exists - check if it's a string type
-                if isinstance(store[key], str):
-                    try:
-                        # Try to convert the value to an integer
-                        current_value = int(store[key])
-                        # Increment by 1
-                        new_value = current_value + 1
-                        # Store the new value as a string
-                        store[key] = str(new_value)
-                        # Return the new value as an integer
-                        conn.sendall(encode_resp(new_value))
-                    except ValueError:
-                        # Value is not a valid integer
-                        conn.sendall(b"-ERR value is not an integer or out of range\r\n")
-                else:
-                    # Key exists but is not a string (could be list, stream, etc.)
-                    conn.sendall(b"-ERR WRONGTYPE Operation against a key holding the wrong kind of value\r\n")
+def cmd_xadd(client, command_parts):
+    if len(command_parts) < 4:
+        return ERR_WRONG_ARGS
+
+    key = command_parts[1]
+    # Stream IDs are short ASCII, so they are the one argument kept as str
+    entry_id = command_parts[2].decode()
+
+    # Parse field-value pairs (must be even number of arguments after ID)
+    field_value_pairs = command_parts[3:]
+    if len(field_value_pairs) % 2 != 0:
+        return ERR_WRONG_ARGS
+
+    # Create stream if it doesn't exist
+    if key not in streams:
+        if key in strings or key in lists:
+            return ERR_WRONGTYPE
+        streams[key] = {'entries': {}}
+
+    # Handle different ID formats
+    if entry_id == "*":
+        # Auto-generate full ID (timestamp and sequence)
+        entry_id = generate_stream_id(key)
+    elif entry_id.endswith('-*'):
+        # Auto-generate sequence number only
+        is_valid, final_id = validate_stream_id(key, entry_id)
+        if not is_valid:
+            if final_id.split('-')[0] == '0' and final_id.split('-')[1] == '0':
+                return ERR_XADD_ID_ZERO
             else:
-                # Key doesn't exist - treat as if value was 0, then increment to 1
-                new_value = 1
-                store[key] = str(new_value)
-                conn.sendall(encode_resp(new_value))
-
-    # RPUSH
-    elif cmd == "RPUSH":
-        key = command_parts[1]
-        values = command_parts[2:]
-        if key not in store or not isinstance(store[key], list):
-            store[key] = []
-        store[key].extend(values)
-        conn.sendall(encode_resp(len(store[key])))
-
-    # LPUSH
-    elif cmd == "LPUSH":
-        key = command_parts[1]
-        values = command_parts[2:]
-        if key not in store or not isinstance(store[key], list):
-            store[key] = []
-        # Insert values one by one at the beginning
-        for value in values:
-            store[key].insert(0, value)
-        conn.sendall(encode_resp(len(store[key])))
-
-    # LPOP
-    elif cmd == "LPOP":
-        key = command_parts[1]
-        count = int(command_parts[2]) if len(command_parts) > 2 else 1
-        if key in store and isinstance(store[key], list) and store[key]:
-            popped = []
-            for _ in range(min(count, len(store[key]))):
-                popped.append(store[key].pop(0))
-            if count == 1:
-                conn.sendall(encode_resp(popped[0]))
+                return ERR_XADD_ID_TOO_SMALL
+        entry_id = final_id
+    else:
+        # Explicit ID - validate it  
+        is_valid, final_id = validate_stream_id(key, entry_id)
+        if not is_valid:
+            if entry_id == '0-0':
+                return ERR_XADD_ID_ZERO
             else:
-                conn.sendall(encode_resp(popped))
-        else:
-            conn.sendall(b"$-1\r\n")
+                return ERR_XADD_ID_TOO_SMALL
 
-    # BLPOP
-    elif cmd == "BLPOP":
-        keys = command_parts[1:-1]
-        timeout = float(command_parts[-1])
+    # Build entry data
+    entry_data = {}
+    for i in range(0, len(field_value_pairs), 2):
+        field = field_value_pairs[i]
+        value = field_value_pairs[i + 1]
+        entry_data[field] = value
 
-        # Special case: timeout 0 means block indefinitely
-        if timeout == 0:
-            timeout = float('inf')
-            
-        end_time = time.time() + timeout
-
-        while time.time() < end_time:
-            for k in keys:
-                if k in store and isinstance(store[k], list) and store[k]:
-                    value = store[k].pop(0)
-                    # Return array with key and value
-                    conn.sendall(encode_resp([k, value]))
-                    return
-            time.sleep(0.01)  # Reduced sleep time for better responsiveness
-
-        # Timeout reached, return null array
-        conn.sendall(b"*-1\r\n")
-
-    # LRANGE
-    elif cmd == "LRANGE":
-        key = command_parts[1]
-        start = int(command_parts[2])
-        stop = int(command_parts[3])
-        
-        if key not in store or not isinstance(store[key], list):
-            # Return empty array if key doesn't exist or isn't a list
-            conn.sendall(encode_resp([]))
-        else:
-            lst = store[key]
-            # Handle negative indices
-            if start < 0:
-                start = len(lst) + start
-            if stop < 0:
-                stop = len(lst) + stop
-            
-            # Clamp indices to valid range
-            start = max(0, start)
-            stop = min(len(lst) - 1, stop)
-            
-            if start <= stop and start < len(lst):
-                result = lst[start:stop + 1]
-                conn.sendall(encode_resp(result))
-            else:
-                conn.sendall(encode_resp([]))
-
-    # LLEN
-    elif cmd == "LLEN":
-        key = command_parts[1]
-        if key not in store or not isinstance(store[key], list):
-            # Return 0 if key doesn't exist or isn't a list
-            conn.sendall(encode_resp(0))
-        else:
-            # Return the length of the list
-            conn.sendall(encode_resp(len(store[key])))
-
-    # TYPE
-    elif cmd == "TYPE":
-        key = command_parts[1]
-        if key not in store:
-            # Key doesn't exist
-            conn.sendall(encode_resp("none"))
-        elif isinstance(store[key], str):
-            conn.sendall(encode_resp("string"))
-        elif isinstance(store[key], list):
-            conn.sendall(encode_resp("list"))
-        elif isinstance(store[key], dict) and 'entries' in store[key]:
-            conn.sendall(encode_resp("stream"))
-        else:
-            # For any other type
-            conn.sendall(encode_resp("none"))
+    # Add entry to stream
+    streams[key]['entries'][entry_id] = entry_data
 
-    # XADD
-    elif cmd == "XADD":
-        if len(command_parts) < 4:
-            conn.sendall(b"-ERR wrong number of arguments\r\n")
-            return
-            
-        key = command_parts[1]
-        entry_id = command_parts[2]
-        
-        # Parse field-value pairs (must be even number of arguments after ID)
-        field_value_pairs = command_parts[3:]
-        if len(field_value_pairs) % 2 != 0:
-            conn.sendall(b"-ERR wrong number of arguments\r\n")
-            return
-        
-        # Create stream if it doesn't exist
-        if key not in store or not isinstance(store[key], dict):
-            store[key] = {'entries': {}}
-        
-        # Handle different ID formats
-        if entry_id == "*":
-            # Auto-generate full ID (timestamp and sequence)
-            entry_id = generate_stream_id(key)
-        elif entry_id.endswith('-*'):
-            # Auto-generate sequence number only
-            is_valid, final_id = validate_stream_id(key, entry_id)
-            if not is_valid:
-                if final_id.split('-')[0] == '0' and final_id.split('-')[1] == '0':
-                    conn.sendall(b"-ERR The ID specified in XADD must be greater than 0-0\r\n")
-                else:
-                    conn.sendall(b"-ERR The ID specified in XADD is equal or smaller than the target stream top item\r\n")
-                return
-            entry_id = final_id
+    # Wake clients blocked in XREAD on this stream
+    notify_key(key)
+
+    # Return the generated/used ID
+    return encode_resp(entry_id)
+
+
+def cmd_xrange(client, command_parts):
+    if len(command_parts) < 4:
+        return ERR_WRONG_ARGS
+
+    key = command_parts[1]
+    start_id = command_parts[2].decode()
+    end_id = command_parts[3].decode()
+
+    # Check if stream exists
+    if not streams.get(key, {}).get('entries'):
+        # Return empty array for non-existent stream
+        return encode_resp([])
+
+    stream = streams[key]
+    entries = stream['entries']
+
+    # Normalize range IDs
+    normalized_start = normalize_range_id(start_id, is_start=True)
+    normalized_end = normalize_range_id(end_id, is_start=False)
+
+    # Filter entries within range
+    result = []
+    for entry_id in entries:
+        # Check if entry_id is within range
+        if normalized_end == "+":
+            # End is maximum, only check start
+            if compare_stream_ids(entry_id, normalized_start) >= 0:
+                # Format entry data as [field1, value1, field2, value2, ...]
+                entry_data = entries[entry_id]
+                field_value_list = []
+                for field, value in entry_data.items():
+                    field_value_list.extend([field, value])
+                result.append([entry_id, field_value_list])
         else:
-            # Explicit ID - validate it  
-            is_valid, final_id = validate_stream_id(key, entry_id)
-            if not is_valid:
-                if entry_id == '0-0':
-                    conn.sendall(b"-ERR The ID specified in XADD must be greater than 0-0\r\n")
-                else:
-                    conn.sendall(b"-ERR The ID specified in XADD is equal or smaller than the target stream top item\r\n")
-                return
-        
-        # Build entry data
-        entry_data = {}
-        for i in range(0, len(field_value_pairs), 2):
-            field = field_value_pairs[i]
-            value = field_value_pairs[i + 1]
-            entry_data[field] = value
-        
-        # Add entry to stream
-        store[key]['entries'][entry_id] = entry_data
-        
-        # Notify blocking clients waiting on this stream
-        notify_blocking_clients(key)
-        
-        # Return the generated/used ID
-        conn.sendall(encode_resp(entry_id))
+            # Check both start and end bounds
+            if (compare_stream_ids(entry_id, normalized_start) >= 0 and 
+                compare_stream_ids(entry_id, normalized_end) <= 0):
+                # Format entry data as [field1, value1, field2, value2, ...]
+                entry_data = entries[entry_id]
+                field_value_list = []
+                for field, value in entry_data.items():
+                    field_value_list.extend([field, value])
+                result.append([entry_id, field_value_list])
 
-    # XRANGE
-    elif cmd == "XRANGE":
-        if len(command_parts) < 4:
-            conn.sendall(b"-ERR wrong number of arguments\r\n")
-            return
-            
-        key = command_parts[1]
-        start_id = command_parts[2]
-        end_id = command_parts[3]
-        
-        # Check if stream exists
-        if (key not in store or 
-            not isinstance(store[key], dict) or 
-            not store[key].get('entries')):
-            # Return empty array for non-existent stream
-            conn.sendall(encode_resp([]))
-            return
-        
-        stream = store[key]
-        entries = stream['entries']
-        
-        # Normalize range IDs
-        normalized_start = normalize_range_id(start_id, is_start=True)
-        normalized_end = normalize_range_id(end_id, is_start=False)
-        
-        # Filter entries within range
-        result = []
-        for entry_id in entries:
-            # Check if entry_id is within range
-            if normalized_end == "+":
-                # End is maximum, only check start
-                if compare_stream_ids(entry_id, normalized_start) >= 0:
-                    # Format entry data as [field1, value1, field2, value2, ...]
-                    entry_data = entries[entry_id]
-                    field_value_list = []
-                    for field, value in entry_data.items():
-                        field_value_list.extend([field, value])
-                    result.append([entry_id, field_value_list])
-            else:
-                # Check both start and end bounds
-                if (compare_stream_ids(entry_id, normalized_start) >= 0 and 
-                    compare_stream_ids(entry_id, normalized_end) <= 0):
-                    # Format entry data as [field1, value1, field2, value2, ...]
-                    entry_data = entries[entry_id]
-                    field_value_list = []
-                    for field, value in entry_data.items():
-                        field_value_list.extend([field, value])
-                    result.append([entry_id, field_value_list])
-        
-        conn.sendall(encode_resp(result))
+    return encode_resp(result)
 
-    # XREAD
-    elif cmd == "XREAD":
-        if len(command_parts) < 4:
-            conn.sendall(b"-ERR wrong number of arguments\r\n")
-            return
-        
-        # Parse optional BLOCK parameter
-        block_timeout = None
-        args_start_index = 1
-        
-        if len(command_parts) > 1 and command_parts[1].upper() == "BLOCK":
-            if len(command_parts) < 6:  # Need at least XREAD BLOCK timeout STREAMS key id
-                conn.sendall(b"-ERR wrong number of arguments\r\n")
-                return
-            try:
-                block_timeout = int(command_parts[2]) / 1000.0  # Convert ms to seconds
-                if block_timeout == 0:
-                    block_timeout = float('inf')  # 0 means block indefinitely
-                args_start_index = 3
-            except ValueError:
-                conn.sendall(b"-ERR timeout is not an integer or out of range\r\n")
-                return
-        
-        # Find "streams" keyword
-        streams_index = -1
-        for i in range(args_start_index, len(command_parts)):
-            if command_parts[i].upper() == "STREAMS":
-                streams_index = i
-                break
-        
-        if streams_index == -1:
-            conn.sendall(b"-ERR syntax error\r\n")
-            return
-        
-        # Parse stream keys and IDs
-        remaining_args = command_parts[streams_index + 1:]
-        if len(remaining_args) % 2 != 0:
-            conn.sendall(b"-ERR wrong number of arguments\r\n")
-            return
-        
-        num_streams = len(remaining_args) // 2
-        stream_keys = remaining_args[:num_streams]
-        stream_ids = remaining_args[num_streams:]
-        
-        # Process each stream to get immediate results
-        result = []
-        processed_stream_ids = []  # Store the actual IDs used for comparison
-        
-        for i in range(num_streams):
-            stream_key = stream_keys[i]
-            start_id = stream_ids[i]
-            
-            # Handle special '$' ID - means "only new entries"
-            if start_id == '$':
-                # Check if stream exists and get the latest ID
-                if (stream_key in store and 
-                    isinstance(store[stream_key], dict) and 
-                    store[stream_key].get('entries')):
-                    stream = store[stream_key]
-                    entries = stream['entries']
-                    # Get the maximum (latest) ID in the stream
-                    latest_id = max(entries.keys(), key=lambda x: (int(x.split('-')[0]), int(x.split('-')[1])))
-                    actual_start_id = latest_id
-                else:
-                    # Stream doesn't exist, use 0-0 so any new entry will be greater
-                    actual_start_id = "0-0"
+
+def cmd_xread(client, command_parts):
+    if len(command_parts) < 4:
+        return ERR_WRONG_ARGS
+
+    # Parse optional BLOCK parameter
+    block_timeout = None
+    args_start_index = 1
+
+    if len(command_parts) > 1 and command_parts[1].upper() == b"BLOCK":
+        if len(command_parts) < 6:  # Need at least XREAD BLOCK timeout STREAMS key id
+            return ERR_WRONG_ARGS
+        try:
+            block_timeout = int(command_parts[2]) / 1000.0  # Convert ms to seconds
+            if block_timeout == 0:
+                block_timeout = float('inf')  # 0 means block indefinitely
+            args_start_index = 3
+        except ValueError:
+            return ERR_TIMEOUT_NOT_INTEGER
+
+    # Find "streams" keyword
+    streams_index = -1
+    for i in range(args_start_index, len(command_parts)):
+        if command_parts[i].upper() == b"STREAMS":
+            streams_index = i
+            break
+
+    if streams_index == -1:
+        return ERR_SYNTAX
+
+    # Parse stream keys and IDs
+    remaining_args = command_parts[streams_index + 1:]
+    if len(remaining_args) % 2 != 0:
+        return ERR_WRONG_ARGS
+
+    num_streams = len(remaining_args) // 2
+    stream_keys = remaining_args[:num_streams]
+    stream_ids = [stream_id.decode() for stream_id in remaining_args[num_streams:]]
+
+    # Resolve the special '$' ID - means "only new entries"
+    processed_stream_ids = []  # Store the actual IDs used for comparison
+
+    for i in range(num_streams):
+        stream_key = stream_keys[i]
+        start_id = stream_ids[i]
+
+        if start_id == '$':
+            # Check if stream exists and get the latest ID
+            if streams.get(stream_key, {}).get('entries'):
+                stream = streams[stream_key]
+                entries = stream['entries']
+                # Get the maximum (latest) ID in the stream
+                latest_id = max(entries.keys(), key=lambda x: (int(x.split('-')[0]), int(x.split('-')[1])))
+                actual_start_id = latest_id
             else:
-                actual_start_id = start_id
-            
-            processed_stream_ids.append(actual_start_id)
-            
-            # Check if stream exists
-            if (stream_key not in store or 
-                not isinstance(store[stream_key], dict) or 
-                not store[stream_key].get('entries')):
-                continue
-            
-            stream = store[stream_key]
-            entries = stream['entries']
-            
-            # Find entries after the specified start_id
-            stream_entries = []
-            for entry_id in entries:
-                if compare_stream_ids(entry_id, actual_start_id) > 0:
-                    # Format entry data as [field1, value1, field2, value2, ...]
-                    entry_data = entries[entry_id]
-                    field_value_list = []
-                    for field, value in entry_data.items():
-                        field_value_list.extend([field, value])
-                    stream_entries.append([entry_id, field_value_list])
-            
-            # Only include streams that have entries
-            if stream_entries:
-                result.append([stream_key, stream_entries])
-        
-        # If we have immediate results or no blocking, return immediately
-        if result or block_timeout is None:
-            conn.sendall(encode_resp(result))
+                # Stream doesn't exist, use 0-0 so any new entry will be greater
+                actual_start_id = "0-0"
         else:
-            # No immediate results and blocking requested
-            timeout_end = time.time() + block_timeout
-            
-            # Add client to blocking list for all requested streams
-            # Use the processed IDs (with $ resolved) for blocking
-            with blocking_clients_lock:
-                for stream_key in stream_keys:
-                    if stream_key not in blocking_clients:
-                        blocking_clients[stream_key] = []
-                    blocking_clients[stream_key].append((conn, stream_keys, processed_stream_ids, timeout_end))
+            actual_start_id = start_id
+
+        processed_stream_ids.append(actual_start_id)
 
+    result = collect_stream_entries(stream_keys, processed_stream_ids)
+
+    # If we have immediate results or no blocking, return immediately
+    if result or block_timeout is None:
+        return encode_resp(result)
+
+    # No immediate results and blocking requested
+    if client is None:
+        # Inside EXEC there is no client to park, so behave as if the timeout expired
+        return NIL
+
+    def read_new_entries():
+        result = collect_stream_entries(stream_keys, processed_stream_ids)
+        return encode_resp(result) if result else None
+
+    # Park the client until XADD on any requested stream, using the processed IDs (with $ resolved)
+    client.block(BlockedClient(client, stream_keys, read_new_entries, NIL, block_timeout))
+    return None
+
+
+# Command name (upper-cased) -> handler(client, command_parts) returning the encoded reply
+# (bytes or a list of bytes fragments), or None when the client was parked by a blocking command
+COMMANDS = {
+    b"PING": cmd_ping,
+    b"ECHO": cmd_echo,
+    b"MULTI": cmd_multi,
+    b"EXEC": cmd_exec,
+    b"DISCARD": cmd_discard,
+    b"SET": cmd_set,
+    b"GET": cmd_get,
+    b"INCR": cmd_incr,
+    b"RPUSH": cmd_rpush,
+    b"LPUSH": cmd_lpush,
+    b"LPOP": cmd_lpop,
+    b"BLPOP": cmd_blpop,
+    b"LRANGE": cmd_lrange,
+    b"LLEN": cmd_llen,
+    b"TYPE": cmd_type,
+    b"XADD": cmd_xadd,
+    b"XRANGE": cmd_xrange,
+    b"XREAD": cmd_xread,
+}
+
+# Every upper/lower-case spelling of each command name -> canonical name, so dispatch is a dict
+# lookup instead of allocating an upper-cased copy of the name per request
+COMMAND_NAMES = {
+    bytes(spelling): name
+    for name in COMMANDS
+    for spelling in itertools.product(*((c, c | 0x20) for c in name))
+}
+
+# Commands that act on the transaction itself and are never queued
+TRANSACTION_COMMANDS = {b"MULTI", b"EXEC", b"DISCARD"}
+
+
+def handle_command(client, command_parts):
+    if not command_parts:
+        return
+
+    cmd = COMMAND_NAMES.get(command_parts[0])
+    if cmd is None:
+        client.write(ERR_UNKNOWN_COMMAND)
+    elif client in client_transactions and cmd not in TRANSACTION_COMMANDS:
+        # Queue the command in transaction mode
+        client_transactions[client].append(command_parts)
+        client.write(QUEUED)
     else:
-        conn.sendall(b"-ERR unknown command\r\n")
+        try:
+            reply = COMMANDS[cmd](client, command_parts)
+        except Exception:
+            # A bad argument fails only its own command; the rest of the pipeline still runs
+            reply = ERR_SERVER
+        if reply is not None:
+            client.write(reply)
+
+
+# Flush queued replies early past this many fragments: IOV_MAX, the most one sendmsg() call can take
+MAX_PENDING_FRAGMENTS = 1024
+
 
+class RedisProtocol(asyncio.BufferedProtocol):
+    """Per-connection state, driven by read-readiness callbacks from the selector loop.
 
-def client_thread(conn):
-    buffer = b""
-    while True:
+    As a BufferedProtocol the transport recv_into()s straight into the parser's
+    buffer, so no bytes object is allocated per read.
+    """
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.parser = RESPParser()
+        self.blocked = None  # BlockedClient while a blocking command is parked
+        self.out = []  # Reply fragments waiting for the next flush(); reused across batches
+
+    def get_buffer(self, sizehint):
+        return self.parser.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.parser.buffer_updated(nbytes)
+        self.process_commands()
+
+    def process_commands(self):
+        global now_ns
+        now_ns = time.monotonic_ns()
+        out = self.out
+        # Bind per-command lookups to locals once per read rather than once per pipelined command
+        next_command = self.parser.next_command
+        dispatch = handle_command
         try:
-            data = conn.recv(4096)
-            if not data:
-                break
-            buffer += data
-            while buffer:
-                command_parts, buffer = parse_resp(buffer)
+            # Commands pipelined behind a blocking command wait until it is served
+            while self.blocked is None:
+                command_parts = next_command()
                 if not command_parts:
                     break
-                handle_command(conn, command_parts)
-        except ConnectionResetError:
-            break
-        except Exception:
+                dispatch(self, command_parts)
+                if len(out) >= MAX_PENDING_FRAGMENTS:
+                    self.flush()
+        except ValueError:
+            # Malformed RESP leaves no way to find the next command, so reply and drop the client
+            self.write(ERR_PROTOCOL)
+            self.flush()
+            self.transport.close()
+        finally:
+            # Replies produced before a failure still go out, including one queued by unblock()
+            self.flush()
+
+    def write(self, reply):
+        # Replies are queued and sent by flush() once the commands from this read are processed
+        if type(reply) is list:
+            self.out.extend(reply)
+        else:
+            self.out.append(reply)
+
+    def flush(self):
+        # All queued replies go out as one scatter write (sendmsg on Python 3.12+) without joining
+        # The transport copies the fragment references it keeps, so one list is reused for the
+        # connection's lifetime instead of allocating a new one per batch
+        if self.out:
+            self.transport.writelines(self.out)
+            self.out.clear()
+
+    def block(self, waiter):
+        self.blocked = waiter
+
+    def unblock(self, reply):
+        self.blocked = None
+        self.write(reply)
+        # Resume buffered commands (and flush this reply) on the next loop iteration rather than
+        # inside the waker's command
+        asyncio.get_running_loop().call_soon(self.process_commands)
+
+    def connection_lost(self, exc):
+        if self.blocked:
+            self.blocked.cancel()
+            self.blocked = None
+        # Clean up client transaction when connection closes
+        if self in client_transactions:
+            del client_transactions[self]
+        self.parser.release()
+
+
+def raise_open_file_limit():
+    """Lift the soft open-file limit to the hard limit so the 1024 default does not cap clients."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return
+    # An unlimited hard limit is not a valid soft limit for open files, so settle for a fixed target.
+    # Only the soft limit moves; lowering the hard limit could not be undone by an unprivileged process
+    target = max(soft, 65536) if hard == resource.RLIM_INFINITY else hard
+    if target <= soft:
+        return
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ValueError, OSError):
+        pass
+
+
+class BusyPollSelector(selectors.DefaultSelector):
+    """Selector that spins on non-blocking polls for a while before sleeping in epoll_wait.
+
+    Trades a busy CPU core for skipping the wake-up latency of a blocking wait when the next
+    request arrives within the spin window.
+    """
+
+    def __init__(self, busy_poll):
+        super().__init__()
+        self.busy_poll = busy_poll  # Seconds to spin before blocking
+
+    def select(self, timeout=None):
+        if timeout is not None and timeout <= 0:
+            # The loop has callbacks ready and only wants a non-blocking poll
+            return super().select(0)
+        start = time.monotonic()
+        spin = self.busy_poll if timeout is None else min(self.busy_poll, timeout)
+        while True:
+            ready = super().select(0)
+            if ready:
+                return ready
+            elapsed = time.monotonic() - start
+            if elapsed >= spin:
+                break
+        if timeout is not None:
+            timeout -= elapsed
+            if timeout <= 0:
+                return ready
+        return super().select(timeout)
+
+
+def new_event_loop(busy_poll=0):
+    """Create the server loop: libuv-based uvloop when installed, else the stdlib epoll selector loop."""
+    if busy_poll:
+        # Busy polling needs control over the selector, so it always uses the stdlib loop
+        return asyncio.SelectorEventLoop(BusyPollSelector(busy_poll))
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    # Single-threaded loop multiplexing every socket through selectors.DefaultSelector (epoll on Linux)
+    return asyncio.SelectorEventLoop(selectors.DefaultSelector())
+
+
+# Listen backlog matching Redis' tcp-backlog default; asyncio's 100 drops SYNs when many clients connect at once
+LISTEN_BACKLOG = 511
+
+
+async def serve(reuse_port=False, socket_buffer=0, unix_socket=None, unix_socket_perm=None):
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(RedisProtocol, "localhost", 6379, reuse_address=True, reuse_port=reuse_port,
+                                      backlog=LISTEN_BACKLOG)
+    if socket_buffer:
+        # Accepted connections inherit the listener's buffer sizes (asyncio already sets TCP_NODELAY on each)
+        for sock in server.sockets:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, socket_buffer)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, socket_buffer)
+    servers = [server]
+    if unix_socket:
+        # Local clients can skip the TCP/IP stack; connections are served exactly like TCP ones
+        unix_server = await loop.create_unix_server(RedisProtocol, unix_socket, backlog=LISTEN_BACKLOG)
+        if unix_socket_perm is not None:
+            os.chmod(unix_socket, unix_socket_perm)
+        servers.append(unix_server)
+    # serve_forever() closes each server when the loop shuts down
+    await asyncio.gather(*(s.serve_forever() for s in servers))
+
+
+# prctl(2) option asking the kernel to signal a child when its parent exits
+PR_SET_PDEATHSIG = 1
+
+
+def exit_with_parent(parent_pid):
+    """Have the kernel SIGTERM this worker if the supervising parent dies (Linux only)."""
+    try:
+        prctl = ctypes.CDLL(None, use_errno=True).prctl
+    except (OSError, AttributeError):
+        return
+    prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    if os.getppid() != parent_pid:
+        # The parent was already gone before prctl() took effect
+        os._exit(0)
+
+
+def supervise(pids):
+    """Reap the worker processes until all have exited, passing SIGTERM/SIGINT on to them."""
+    def forward(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    while pids:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
             break
-    
-    # Clean up client transaction when connection closes
-    if conn in client_transactions:
-        del client_transactions[conn]
-    
-    conn.close()
+        pids.discard(pid)
 
 
 def main():
-    # Start cleanup thread for expired blocking clients
-    cleanup_thread = threading.Thread(target=cleanup_expired_blocking_clients, daemon=True)
-    cleanup_thread.start()
-    
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(("localhost", 6379))
-    s.listen()
-    while True:
-        conn, _ = s.accept()
-        threading.Thread(target=client_thread, args=(conn,), daemon=True).start()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes sharing the port via SO_REUSEPORT; each keeps its own keyspace "
+                             "(0 = one per available CPU)")
+    parser.add_argument("--pin-cpus", action="store_true",
+                        help="pin each worker process to its own CPU (Linux)")
+    parser.add_argument("--socket-buffer", type=int, default=0, metavar="BYTES",
+                        help="SO_RCVBUF/SO_SNDBUF for client sockets; 0 keeps the kernel's auto-tuning")
+    parser.add_argument("--busy-poll", type=int, default=0, metavar="USEC",
+                        help="spin this long polling for events before blocking (burns a core for lower latency)")
+    parser.add_argument("--unixsocket", metavar="PATH",
+                        help="also listen on this Unix domain socket (first worker only)")
+    parser.add_argument("--unixsocketperm", type=lambda mode: int(mode, 8), metavar="MODE",
+                        help="octal permissions for the Unix socket file, e.g. 660")
+    args = parser.parse_args()
+
+    raise_open_file_limit()
+
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    if args.workers == 0:
+        args.workers = len(cpus) or os.cpu_count() or 1
+
+    worker = 0
+    if args.workers > 1:
+        # Pre-fork workers; each binds its own SO_REUSEPORT socket and the kernel spreads connections across
+        # them. The parent stays behind as their supervisor so no worker outlives it
+        parent_pid = os.getpid()
+        pids = set()
+        for i in range(args.workers):
+            pid = os.fork()
+            if pid == 0:
+                worker = i
+                exit_with_parent(parent_pid)
+                break
+            pids.add(pid)
+        else:
+            supervise(pids)
+            return
+
+    if args.pin_cpus and cpus:
+        # One worker per core keeps each process's keyspace and socket buffers in that core's caches
+        os.sched_setaffinity(0, {cpus[worker % len(cpus)]})
+
+    # A socket path cannot be shared like a SO_REUSEPORT port, so only the first worker binds it
+    unix_socket = args.unixsocket if worker == 0 else None
+    with asyncio.Runner(loop_factory=lambda: new_event_loop(args.busy_poll / 1e6)) as runner:
+        runner.run(serve(reuse_port=args.workers > 1, socket_buffer=args.socket_buffer,
+                         unix_socket=unix_socket, unix_socket_perm=args.unixsocketperm))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()